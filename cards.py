@@ -80,6 +80,14 @@ class Card:
     def __str__(self):
         return f"{self.value}{self.suit}"
 
+    @property
+    def code(self):
+        '''
+        integer code of the card i.e., its index in ORDERED (0 = 2C, ..., 51 = AS)
+        code % 13 is the index of the value and code // 13 is the index of the suit
+        '''
+        return self.ORDERED.index(str(self))
+
     def __add__(self, new):
         if isinstance(new, Card) or isinstance(new, Stack):
             return Stack(self, new)
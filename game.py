@@ -187,6 +187,10 @@ class ThirtyOne():
 
         # key players
         self.knocker = None  # who knocked?
+        self.winner = None  # who got 31?
+
+        # how did the game end?
+        self.deck_exhausted = False  # ran out of cards to draw
     
     def __repr__(self):
         return self.print()
@@ -355,6 +359,7 @@ class ThirtyOne():
             
             # deck has no cards so end
             else:
+                self.deck_exhausted = True
                 self.end_game()
 
         # if score is 31, game over
@@ -366,6 +371,10 @@ class ThirtyOne():
 
     def end_game(self, knocker=None, winner=None):
         
+        # track winner
+        if winner is not None:
+            self.winner = winner
+
         # game won via 31
         if winner:
             # everyone but winner loses a life
@@ -382,13 +391,20 @@ class ThirtyOne():
                         # if tie, knocker is safe
                         self.chips[player] = max(0, self.chips[player] - 1)
 
-    def play(self, knocker=None):
+    def play(self, knocker=None, accelerated=False):
         '''
         play through, at most, two full rounds:
         1. in the first round, the knocker will knock without picking up any cards
         2. after the kocker knocks, everyone else gets another turn
+
+        if accelerated, play the same game with the integer-array kernel (see kernel.py)
         '''
 
+        if accelerated:
+            import kernel  # kernel imports this module
+            kernel.play(self, knocker)
+            return
+
         # track knocker
         self.knocker = knocker
 
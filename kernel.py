@@ -0,0 +1,289 @@
+# Dependencies
+
+# general
+import copy
+from itertools import cycle
+import random
+import sys
+import numpy as np
+
+# compile the kernel if numba is installed
+# otherwise, run the same functions as plain Python
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# game
+import cards
+import game
+
+# Constants
+
+# cards are integer codes i.e., their index in Card.ORDERED
+# so code % 13 = value and code // 13 = suit
+CODES = {card: code for code, card in enumerate(cards.Card.ORDERED)}
+
+# points per card code
+POINTS = np.array([
+    [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11][code % 13]
+    for code in range(len(cards.Card.ORDERED))
+], dtype=np.float64)
+
+# state indexes
+DECK_LEN = 0
+DISCARD_LEN = 1
+TURNS = 2
+ROUND = 3
+CURRENT_PLAYER = 4
+WINNER = 5  # -1 = no winner
+DECK_EXHAUSTED = 6
+
+# Funcs
+
+def build_potential_scores(hand_scores):
+    '''
+    precompute calc_potential_scores for every pair of kept cards and replaced card
+    i.e., potential[a, b, x] = average score of a, b, and any card other than x
+    computed the same way as calc_potential_scores (incl. rounding) so ties break the same way
+    '''
+
+    one = hand_scores['card_one'].map(CODES).to_numpy()
+    two = hand_scores['card_two'].map(CODES).to_numpy()
+    three = hand_scores['card_three'].map(CODES).to_numpy()
+    scores = hand_scores['score'].to_numpy()
+
+    totals = np.zeros((52, 52), dtype=scores.dtype)
+    counts = np.zeros((52, 52), dtype=np.int64)
+    np.add.at(totals, (one, two), scores)
+    np.add.at(counts, (one, two), 1)
+
+    potential = np.zeros((52, 52, 52), dtype=np.float64)
+    potential[one, two, three] = np.round((totals[one, two] - scores) / (counts[one, two] - 1), 3)
+    return potential
+
+POTENTIAL_SCORES = build_potential_scores(game.HAND_SCORES)
+
+# Kernel
+
+@njit
+def _score(points, c0, c1, c2):
+    '''
+    same as Hand.score
+    '''
+
+    # if all same value, then 30
+    if c0 % 13 == c1 % 13 and c1 % 13 == c2 % 13:
+        return 30.5
+
+    # otherwise, tally score per suit and take max
+    max_score = 0.0
+    for suit in range(4):
+        score = 0.0
+        if c0 // 13 == suit:
+            score += points[c0]
+        if c1 // 13 == suit:
+            score += points[c1]
+        if c2 // 13 == suit:
+            score += points[c2]
+        if score > max_score:
+            max_score = score
+    return max_score
+
+@njit
+def _worst_card(potential, c0, c1, c2):
+    '''
+    same as Hand.worst_card but returns the card's position in the hand
+    '''
+    worst = 0
+    worst_score = potential[c1, c2, c0]
+    if potential[c0, c2, c1] > worst_score:
+        worst = 1
+        worst_score = potential[c0, c2, c1]
+    if potential[c0, c1, c2] > worst_score:
+        worst = 2
+    return worst
+
+@njit
+def _end_game(chips, state, winner):
+    '''
+    same as ThirtyOne.end_game(winner=winner)
+    '''
+    state[WINNER] = winner
+    if winner != 0:  # ThirtyOne.end_game checks `if winner:`
+        for player in range(chips.shape[0]):
+            if player != winner:
+                chips[player] = max(0, chips[player] - 1)
+
+@njit
+def _advance_counters(state, num_players):
+    '''
+    same as ThirtyOne.advance_counters
+    '''
+    state[CURRENT_PLAYER] = (state[CURRENT_PLAYER] + 1) % num_players
+    state[TURNS] += 1
+    if state[CURRENT_PLAYER] == num_players - 1:
+        state[ROUND] += 1
+
+@njit
+def _play_hand(hands, deck, discard, chips, state, potential, points):
+    '''
+    same as ThirtyOne.play_hand
+    '''
+
+    player = state[CURRENT_PLAYER]
+    hand = hands[player]
+
+    # if score is 31, game over
+    if _score(points, hand[0], hand[1], hand[2]) == 31:
+        _end_game(chips, state, player)
+
+    score = _score(points, hand[0], hand[1], hand[2])
+    worst = _worst_card(potential, hand[0], hand[1], hand[2])
+    remove_card = hand[worst]
+
+    # if discard card improves hand's score, take it
+    hand[worst] = discard[state[DISCARD_LEN] - 1]
+    if _score(points, hand[0], hand[1], hand[2]) > score:
+        discard[state[DISCARD_LEN] - 1] = remove_card  # put replaced card in discard pile
+
+    else:
+        hand[worst] = remove_card
+
+        # if deck has cards
+        if state[DECK_LEN] > 0:
+
+            # otherwise, draw the top card
+            state[DECK_LEN] -= 1
+            drawn_card = deck[state[DECK_LEN]]
+
+            # if the top card improves hand's score, take it
+            hand[worst] = drawn_card
+            if _score(points, hand[0], hand[1], hand[2]) > score:
+                discard[state[DISCARD_LEN]] = remove_card
+            else:
+                # otherwise, put top card on top of discard pile
+                hand[worst] = remove_card
+                discard[state[DISCARD_LEN]] = drawn_card
+            state[DISCARD_LEN] += 1
+
+        # deck has no cards so end
+        else:
+            state[DECK_EXHAUSTED] = 1
+
+    # if score is 31, game over
+    if _score(points, hand[0], hand[1], hand[2]) == 31:
+        _end_game(chips, state, player)
+
+    # update counters
+    _advance_counters(state, hands.shape[0])
+
+@njit
+def _play(hands, deck, discard, chips, state, knocker, potential, points):
+    '''
+    same as ThirtyOne.play
+    '''
+
+    # for every player before knocker,
+    # play hand
+    for player in range(knocker):
+        _play_hand(hands, deck, discard, chips, state, potential, points)
+
+    # knocker knocks ie skips their turn
+    _advance_counters(state, hands.shape[0])
+
+    # everyone else gets one more play
+    while state[CURRENT_PLAYER] != knocker:
+        _play_hand(hands, deck, discard, chips, state, potential, points)
+
+# Funcs
+
+def play(thirty_one, knocker):
+    '''
+    play through a ThirtyOne game with the kernel
+    i.e., encode the game as integer arrays, play, then decode the arrays back into the game
+    '''
+
+    # encode
+    hands = np.array([[CODES[str(card)] for card in hand.cards] for hand in thirty_one.hands], dtype=np.int64)
+    deck = np.zeros(52, dtype=np.int64)
+    deck[:len(thirty_one.deck)] = [CODES[str(card)] for card in thirty_one.deck.cards]
+    discard = np.zeros(52, dtype=np.int64)
+    discard[:len(thirty_one.discard)] = [CODES[str(card)] for card in thirty_one.discard.cards]
+    chips = np.array(thirty_one.chips, dtype=np.int64)
+    state = np.array([
+        len(thirty_one.deck),
+        len(thirty_one.discard),
+        thirty_one.turns,
+        thirty_one.round,
+        thirty_one.current_player,
+        -1 if thirty_one.winner is None else thirty_one.winner,
+        int(thirty_one.deck_exhausted)
+    ], dtype=np.int64)
+
+    # play
+    thirty_one.knocker = knocker
+    _play(hands, deck, discard, chips, state, knocker, POTENTIAL_SCORES, POINTS)
+
+    # decode
+    for hand, codes in zip(thirty_one.hands, hands):
+        hand.cards = [cards.Card(cards.Card.ORDERED[code]) for code in codes]
+    thirty_one.deck.cards = [cards.Card(cards.Card.ORDERED[code]) for code in deck[:state[DECK_LEN]]]
+    thirty_one.discard.cards = [cards.Card(cards.Card.ORDERED[code]) for code in discard[:state[DISCARD_LEN]]]
+    thirty_one.chips = [int(chip) for chip in chips]
+    thirty_one.turns = int(state[TURNS])
+    thirty_one.round = int(state[ROUND])
+    thirty_one.current_player = int(state[CURRENT_PLAYER])
+    thirty_one.winner = None if state[WINNER] == -1 else int(state[WINNER])
+    thirty_one.deck_exhausted = bool(state[DECK_EXHAUSTED])
+
+    # line up the turn cycle so the next advance_counters picks the next player
+    thirty_one._turn_cycle = cycle(thirty_one.players)
+    if thirty_one.turns > 0:
+        for i in range(thirty_one.current_player + 1):
+            next(thirty_one._turn_cycle)
+
+def verify(num_deals=10, seed=0):
+    '''
+    play the same seeded deals with ThirtyOne.play and the kernel and compare the results
+    returns the number of games compared
+    '''
+
+    random.seed(seed)
+    num_games = 0
+    for deal in range(num_deals):
+        num_players = 2 + deal % 5  # 2 to 6 players
+        base_game = game.ThirtyOne(num_players=num_players)
+        for knocker in range(num_players):
+
+            reference = copy.deepcopy(base_game)
+            reference.play(knocker=knocker)
+
+            accelerated = copy.deepcopy(base_game)
+            accelerated.play(knocker=knocker, accelerated=True)
+
+            for attribute in ["chips", "turns", "round", "current_player", "knocker", "winner", "deck_exhausted", "knocker_survived"]:
+                if getattr(reference, attribute) != getattr(accelerated, attribute):
+                    raise AssertionError(f"deal {deal}, knocker {knocker}: {attribute} differs")
+            for attribute in ["hands", "deck", "discard"]:
+                if repr(getattr(reference, attribute)) != repr(getattr(accelerated, attribute)):
+                    raise AssertionError(f"deal {deal}, knocker {knocker}: {attribute} differs")
+            if next(reference._turn_cycle) != next(accelerated._turn_cycle):
+                raise AssertionError(f"deal {deal}, knocker {knocker}: turn cycle differs")
+
+            num_games += 1
+
+    return num_games
+
+if __name__ == "__main__":
+
+    # differential check against the reference implementation
+    # e.g., python kernel.py [num_deals] [seed]
+    num_games = verify(*[int(arg) for arg in sys.argv[1:3]])
+    print(f"kernel matches ThirtyOne.play for {num_games} games (numba available: {NUMBA_AVAILABLE})")
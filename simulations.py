@@ -5,18 +5,180 @@ import copy
 import csv
 from datetime import datetime
 import logging
+import os
+import random
 import sys
 import time
+import uuid
+from tabulate import tabulate
 
 # game
 from game import ThirtyOne
+from store import ResultsStore
 
 # Constants
 
 GAMES_PER_SIMULATION = 10000
+Z_95 = 1.96  # two-sided 95% normal quantile
+RESERVOIR_SIZE = 10  # sampled games kept per num_players/knocker/score
+MAX_ANOMALIES = 10000  # anomalous games kept before they're sampled too
+
+# Funcs
+
+def knock_at_threshold(knocker, threshold):
+    '''
+    knock decision for simulate_paired: the knocker knocks on their initial hand
+    if its score is at least threshold, otherwise nobody knocks
+    '''
+    def knock(game):
+        if game.scores[knocker] >= threshold:
+            return knocker
+        return None
+    return knock
 
 # Classes
 
+class PairedDifference():
+    '''
+    track paired outcomes of a configuration against a baseline configuration
+    played on the same deals (i.e., common random numbers)
+
+    Only running sums are kept so memory doesn't grow with the number of deals.
+
+    Attributes
+    ----------
+    label : str
+        configuration being compared
+    baseline : str
+        configuration being compared against
+    n : int
+        number of paired outcomes
+    '''
+
+    def __init__(self, label, baseline):
+        self.label = label
+        self.baseline = baseline
+        self.n = 0
+        self._sum = 0.0  # sum of outcomes
+        self._sum_sq = 0.0
+        self._sum_baseline = 0.0  # sum of baseline outcomes
+        self._sum_baseline_sq = 0.0
+        self._sum_product = 0.0
+
+    def update(self, outcome, baseline_outcome):
+        '''
+        add one paired outcome
+        '''
+        self.n += 1
+        self._sum += outcome
+        self._sum_sq += outcome * outcome
+        self._sum_baseline += baseline_outcome
+        self._sum_baseline_sq += baseline_outcome * baseline_outcome
+        self._sum_product += outcome * baseline_outcome
+
+    def _covariance(self, sum_x, sum_y, sum_xy):
+        # sample covariance from running sums
+        if self.n < 2:
+            return 0.0
+        return (sum_xy - sum_x * sum_y / self.n) / (self.n - 1)
+
+    @property
+    def mean(self):
+        return self._sum / self.n if self.n > 0 else None
+
+    @property
+    def baseline_mean(self):
+        return self._sum_baseline / self.n if self.n > 0 else None
+
+    @property
+    def difference(self):
+        '''
+        mean paired difference (configuration - baseline)
+        '''
+        return (self._sum - self._sum_baseline) / self.n if self.n > 0 else None
+
+    @property
+    def variance(self):
+        '''
+        sample variance of the paired differences
+        '''
+        var = self._covariance(self._sum, self._sum, self._sum_sq)
+        var_baseline = self._covariance(self._sum_baseline, self._sum_baseline, self._sum_baseline_sq)
+        cov = self._covariance(self._sum, self._sum_baseline, self._sum_product)
+        return max(0.0, var + var_baseline - 2 * cov)
+
+    @property
+    def unpaired_variance(self):
+        '''
+        variance of the difference had the two configurations been played on independent deals
+        '''
+        var = self._covariance(self._sum, self._sum, self._sum_sq)
+        var_baseline = self._covariance(self._sum_baseline, self._sum_baseline, self._sum_baseline_sq)
+        return var + var_baseline
+
+    @property
+    def std_error(self):
+        '''
+        standard error of the mean paired difference
+        undefined (None) until there are at least two paired outcomes
+        '''
+        return (self.variance / self.n) ** 0.5 if self.n > 1 else None
+
+    def confidence_interval(self, z=Z_95):
+        '''
+        normal-approximation confidence interval of the mean paired difference
+        '''
+        if self.n < 2:
+            return None, None
+        margin = z * self.std_error
+        return self.difference - margin, self.difference + margin
+
+    @property
+    def variance_reduction(self):
+        '''
+        factor by which pairing cuts the games needed for the same precision
+        e.g., 4.0 means independent deals would need 4x as many games
+        '''
+        if self.n < 2 or self.variance == 0:
+            return None
+        return self.unpaired_variance / self.variance
+
+class Reservoir():
+    '''
+    keep a uniform random sample of at most k items from a stream of unknown length
+    i.e., Algorithm R
+
+    Attributes
+    ----------
+    k : int
+        maximum number of items kept
+    items : list
+        sampled items
+    seen : int
+        number of items offered so far
+    '''
+
+    def __init__(self, k, rng=None):
+        self.k = k
+        self.items = []
+        self.seen = 0
+        self._rng = rng if rng is not None else random.Random()
+
+    def __len__(self):
+        return len(self.items)
+
+    def offer(self, item):
+        '''
+        consider an item for the sample
+        '''
+        self.seen += 1
+        if len(self.items) < self.k:
+            self.items.append(item)
+        else:
+            idx = self._rng.randrange(self.seen)
+            if idx < self.k:
+                self.items[idx] = item
+
 class Simulator():
     '''
     a simulator simulates games and tracks their results
@@ -26,35 +188,82 @@ class Simulator():
     NOW = datetime.now().strftime('%Y-%m-%d %H%M')
     PATH_CSV_OUTPUT = f"output/{NOW}_results.csv"
     PATH_LOG_OUTPUT = f"output/{NOW}_log.log"
+    PATH_PAIRED_CSV_OUTPUT = f"output/{NOW}_paired.csv"
+    PATH_SAMPLES_CSV_OUTPUT = f"output/{NOW}_samples.csv"
+    PATH_AGGREGATE_CSV_OUTPUT = f"output/{NOW}_aggregate.csv"
+    PATH_DB_OUTPUT = f"output/{NOW}_results.db"
+
+    COLUMNS = [
+        "ts_created",
+        
+        "game_id",
+        "game_iteration_id",
+
+        "num_players",
+        "rounds_played",
+        "turns_played",
+
+        "knocker",
+        "knocker_score",
+        "knocker_hand",
+        "knocker_survived",
+
+        "scores",
+        "hands",
+
+        "deck",
+        "discard"
+    ]
     
-    def __init__(self):
+    def __init__(self, write_games=True, reservoir_size=RESERVOIR_SIZE, write_db=False, accelerated=False, run_id=None):
+        '''
+        write_games : bool
+            write every game to the results file
+            otherwise, only the sampled games and the aggregate table are written
+        reservoir_size : int
+            number of games sampled per num_players/knocker/score
+        write_db : bool
+            also write every game to an indexed results store (see store.py)
+        accelerated : bool
+            play games with the integer-array kernel (see kernel.py)
+        run_id : str
+            name of the run in the results store
+            defaults to the start time, process ID, and a random suffix so every Simulator is unique
+        '''
         
         self.game_id = 0  # unique ID for game (i.e., deck, number of players)
+        self.accelerated = accelerated
+        if run_id is None:
+            run_id = f"{datetime.now().strftime('%Y-%m-%d %H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.run_id = run_id
+
+        # aggregate results
+        # (num_players, knocker, knocker_score) -> [game count, knocker survived count]
+        self.aggregates = {}
+
+        # sampled games
+        # use a separate random number generator so sampling doesn't change the deals
+        self._sample_rng = random.Random()
+        self.reservoir_size = reservoir_size
+        self.samples = {}  # (num_players, knocker, knocker_score) -> Reservoir
+        self.anomalies = Reservoir(MAX_ANOMALIES, rng=self._sample_rng)  # deck exhausted or 31
+
+        # paired comparisons
+        # (num_players, baseline, label) -> PairedDifference
+        self.paired = {}
+        self.paired_file = None  # only opened if simulate_paired is used
         
         # set up output file
-        self.output_file = open(self.PATH_CSV_OUTPUT, 'w+', newline='')
-        self.writer = csv.writer(self.output_file, delimiter=',')
-        self.writer.writerow([
-            "ts_created",
-            
-            "game_id",
-            "game_iteration_id",
-
-            "num_players",
-            "rounds_played",
-            "turns_played",
-
-            "knocker",
-            "knocker_score",
-            "knocker_hand",
-            "knocker_survived",
-
-            "scores",
-            "hands",
-
-            "deck",
-            "discard"
-        ])
+        self.output_file = None
+        if write_games:
+            self.output_file = open(self.PATH_CSV_OUTPUT, 'w+', newline='')
+            self.writer = csv.writer(self.output_file, delimiter=',')
+            self.writer.writerow(self.COLUMNS)
+
+        # set up results store
+        self.store = None
+        if write_db:
+            self.store = ResultsStore(self.PATH_DB_OUTPUT)
 
         # set up logger
         # https://stackoverflow.com/questions/13733552/logger-configuration-to-log-to-file-and-print-to-stdout
@@ -96,10 +305,11 @@ class Simulator():
             game = copy.deepcopy(base_game)
 
             # play and set knocker
-            game.play(knocker=knocker)
+            game.play(knocker=knocker, accelerated=self.accelerated)
 
             # save info
-            self.writer.writerow([
+            # stringify now so sampled rows don't hold on to the game
+            row = [
                 unix_ts,
 
                 self.game_id,
@@ -111,22 +321,246 @@ class Simulator():
 
                 knocker,
                 game.scores[knocker],
-                game.hands[knocker],
+                str(game.hands[knocker]),
                 game.knocker_survived,
 
-                game.scores,
-                game.hands,
+                str(game.scores),
+                str(game.hands),
+
+                str(game.deck.cards),
+                str(game.discard)
+            ]
+            if self.store is not None:
+                self.store.add_game(game, self.run_id, self.game_id, knocker, unix_ts)
+            if self.output_file is not None:
+                self.writer.writerow(row)
+            self.track(game, row)
 
-                game.deck.cards,
-                game.discard
+        # clean up
+        if self.output_file is not None:
+            self.output_file.flush()
+        if self.store is not None:
+            self.store.commit()
+        self.game_id += 1
+
+    def track(self, game, row):
+        '''
+        add a played game to the aggregate table and the sampled games
+        '''
+
+        cell = (len(game.players), game.knocker, game.scores[game.knocker])
+
+        # aggregate
+        if cell not in self.aggregates:
+            self.aggregates[cell] = [0, 0]
+        self.aggregates[cell][0] += 1
+        self.aggregates[cell][1] += int(bool(game.knocker_survived))
+
+        # sample
+        if cell not in self.samples:
+            self.samples[cell] = Reservoir(self.reservoir_size, rng=self._sample_rng)
+        self.samples[cell].offer(row)
+
+        # keep anomalous games
+        reasons = []
+        if game.deck_exhausted:
+            reasons.append("deck_exhausted")
+        if game.winner is not None:
+            reasons.append("31")
+        if len(reasons) > 0:
+            self.anomalies.offer(row + ["|".join(reasons)])
+
+    def dump(self):
+        '''
+        write the sampled games and the aggregate table
+        '''
+
+        # sampled games
+        with open(self.PATH_SAMPLES_CSV_OUTPUT, 'w+', newline='') as f:
+            writer = csv.writer(f, delimiter=',')
+            writer.writerow(self.COLUMNS + ["sample_reason"])
+            for cell in sorted(self.samples):
+                for row in self.samples[cell].items:
+                    writer.writerow(row + ["reservoir"])
+            for row in self.anomalies.items:
+                writer.writerow(row)
+
+        if self.anomalies.seen > self.anomalies.k:
+            self.logger.warning(f"kept {self.anomalies.k} of {self.anomalies.seen} anomalous games")
+
+        # aggregate table
+        # same columns as results/results.csv
+        with open(self.PATH_AGGREGATE_CSV_OUTPUT, 'w+', newline='') as f:
+            writer = csv.writer(f, delimiter=',')
+            writer.writerow([
+                "num_players",
+                "knocker",
+                "knocker_score",
+                "game_id_count",
+                "knocker_survived_sum",
+                "win_percentage"
+            ])
+            for (num_players, knocker, knocker_score), (count, survived) in sorted(self.aggregates.items()):
+                writer.writerow([
+                    num_players,
+                    knocker,
+                    knocker_score,
+                    count,
+                    survived,
+                    survived / count
+                ])
+
+    def _get_paired_writer(self):
+        '''
+        open the paired outcomes file on first use
+        '''
+        if self.paired_file is None:
+            self.paired_file = open(self.PATH_PAIRED_CSV_OUTPUT, 'w+', newline='')
+            self.paired_writer = csv.writer(self.paired_file, delimiter=',')
+            self.paired_writer.writerow([
+                "game_id",
+                "num_players",
+
+                "config",
+                "knocker",
+                "knocker_score",
+                "knocker_survived"
+            ])
+        return self.paired_writer
+
+    def simulate_paired(self, num_players, configs):
+        '''
+        play the same deal under every configuration and track paired outcomes
+
+        configs maps a label to a configuration with the following (optional) keys:
+        game : dict
+            rule options for ThirtyOne (e.g., {"num_chips": 5})
+        knocker : int
+            player who knocks on their initial hand
+        knock : callable
+            instead of knocker, decide who knocks from the dealt game
+            returns the knocker or None if nobody knocks (e.g., knock_at_threshold(2, 15))
+        no_knock : float
+            outcome when nobody knocks (required with knock)
+            e.g., 1 counts not knocking as surviving
+        accelerated : bool
+            play with the integer-array kernel (defaults to the Simulator's accelerated)
+        
+        e.g., {"threshold_14": {"knock": knock_at_threshold(2, 14), "no_knock": 1},
+               "threshold_16": {"knock": knock_at_threshold(2, 16), "no_knock": 1}}
+
+        The outcome is 1 if the knocker survived and 0 otherwise. The first configuration is
+        the baseline that every other one is compared against. Every configuration is dealt
+        from the same random state so, for the same rule options, each plays the same
+        shuffled deck and most of the deal-to-deal noise cancels out of the differences.
+        '''
+
+        if len(configs) < 2:
+            raise ValueError("at least two configurations are needed to compare")
+        for label, config in configs.items():
+            unknown = set(config) - {"game", "knocker", "knock", "no_knock", "accelerated"}
+            if len(unknown) > 0:
+                raise ValueError(f"unsupported configuration keys for {label}: {sorted(unknown)}")
+            if ("knocker" in config) == ("knock" in config):
+                raise ValueError(f"configuration {label} needs exactly one of knocker or knock")
+            if "knock" in config and "no_knock" not in config:
+                # leaving out deals where nobody knocks would only keep deals where
+                # e.g., every threshold knocks the same way so every difference would be 0
+                raise ValueError(f"configuration {label} needs no_knock, the outcome when nobody knocks")
+
+        writer = self._get_paired_writer()
+
+        # deal every configuration from the same random state
+        deal_state = random.getstate()
+        next_state = None
+
+        # simulate
+        outcomes = {}
+        for label, config in configs.items():
+
+            # log
+            self.logger.info(f"game_id = {str(self.game_id).zfill(6)}, num_players = {num_players}, config = {label}")
+
+            # deal
+            random.setstate(deal_state)
+            game = ThirtyOne(num_players=num_players, **config.get("game", {}))
+            if next_state is None:
+                next_state = random.getstate()
+
+            # decide who knocks
+            if "knock" in config:
+                knocker = config["knock"](game)
+            else:
+                knocker = config["knocker"]
+
+            # play
+            if knocker is not None:
+                game.play(knocker=knocker, accelerated=config.get("accelerated", self.accelerated))
+                outcomes[label] = int(bool(game.knocker_survived))
+            else:
+                outcomes[label] = config["no_knock"]
+
+            # save info
+            writer.writerow([
+                self.game_id,
+                num_players,
+
+                label,
+                knocker,
+                game.scores[knocker] if knocker is not None else None,
+                game.knocker_survived
             ])
 
+        # continue the random sequence as if only one game was dealt
+        random.setstate(next_state)
+
+        # track paired differences against the baseline
+        labels = list(configs)
+        baseline = labels[0]
+        for label in labels[1:]:
+            key = (num_players, baseline, label)  # same label vs another baseline is tracked separately
+            if key not in self.paired:
+                self.paired[key] = PairedDifference(label, baseline)
+            self.paired[key].update(outcomes[label], outcomes[baseline])
+
         # clean up
-        self.output_file.flush()
+        self.paired_file.flush()
         self.game_id += 1
 
+    def report_paired(self):
+        '''
+        log and return the paired-difference estimates of the outcomes
+        '''
+
+        table = []
+        for (num_players, baseline, label), paired in sorted(self.paired.items()):
+            lower, upper = paired.confidence_interval()
+            table.append({
+                'num_players': num_players,
+                'config': paired.label,
+                'baseline': paired.baseline,
+                'games': paired.n,
+                'outcome': paired.mean,
+                'baseline_outcome': paired.baseline_mean,
+                'difference': paired.difference,
+                'ci_95_lower': lower,
+                'ci_95_upper': upper,
+                'variance_reduction': paired.variance_reduction
+            })
+
+        if len(table) > 0:
+            self.logger.info("paired differences:\n" + tabulate(table, headers='keys', tablefmt='github', floatfmt=".4f"))
+
+        return table
+
     def shutdown(self):
-        self.output_file.close()
+        self.dump()
+        if self.output_file is not None:
+            self.output_file.close()
+        if self.store is not None:
+            self.store.close()
+        if self.paired_file is not None:
+            self.paired_file.close()
 
 if __name__ == "__main__":
 
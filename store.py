@@ -0,0 +1,308 @@
+# Dependencies
+
+# general
+import argparse
+import csv
+import os
+import pathlib
+import re
+import sqlite3
+from tabulate import tabulate
+
+# game
+from cards import Card
+
+# Constants
+
+# cards in results CSV fields e.g., 6H in "[6H, 8H, JH]"
+CARD_PATTERN = re.compile(r"[2-9TJQKA][CDHS]")
+
+# Funcs
+
+def encode_cards(cards):
+    '''
+    convert cards to their integer codes
+    '''
+    return [card.code for card in cards]
+
+def parse_cards(text):
+    '''
+    parse cards from a results CSV field e.g., "[2C, 3H, 2S]"
+    '''
+    return [Card(card) for card in CARD_PATTERN.findall(text)]
+
+def parse_scores(text):
+    '''
+    parse scores from a results CSV field e.g., "[3, 24]"
+    '''
+    return [float(score) for score in text.strip("[]").split(",") if score.strip() != ""]
+
+# Classes
+
+class ResultsStore():
+    '''
+    store simulation results in an indexed SQLite file so they can be filtered and
+    aggregated without loading the whole run into memory
+
+    Cards are stored as integer codes (see Card.code). The games table holds one row per
+    game with the knocker's hand in knocker_card_one, knocker_card_two, and knocker_card_three.
+    The hands table holds every player's hand. The deck and discard pile are stored as
+    blobs of card codes (bottom to top).
+
+    game_id restarts at 0 every run so games are keyed by run_id too (e.g., the Simulator's run_id
+    or the name of the imported CSV). Adding a game that's already in the store raises
+    sqlite3.IntegrityError rather than replacing it.
+
+    Methods
+    -------
+    add_game(game, run_id, game_id, game_iteration_id, ts_created)
+        add a played ThirtyOne game
+
+    import_csv(path, run_id)
+        add the games in a results CSV
+
+    aggregate(...)
+        knocker survival by num_players, knocker, and knocker_score
+    '''
+
+    SCHEMA = [
+        '''
+        CREATE TABLE IF NOT EXISTS games (
+            run_id TEXT NOT NULL,
+            game_id INTEGER NOT NULL,
+            game_iteration_id INTEGER NOT NULL,
+            ts_created REAL,
+            num_players INTEGER NOT NULL,
+            rounds_played INTEGER,
+            turns_played INTEGER,
+            knocker INTEGER NOT NULL,
+            knocker_score REAL NOT NULL,
+            knocker_survived INTEGER NOT NULL,
+            knocker_card_one INTEGER NOT NULL,
+            knocker_card_two INTEGER NOT NULL,
+            knocker_card_three INTEGER NOT NULL,
+            deck BLOB,
+            discard BLOB,
+            PRIMARY KEY (run_id, game_id, game_iteration_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS hands (
+            run_id TEXT NOT NULL,
+            game_id INTEGER NOT NULL,
+            game_iteration_id INTEGER NOT NULL,
+            player INTEGER NOT NULL,
+            score REAL NOT NULL,
+            card_one INTEGER NOT NULL,
+            card_two INTEGER NOT NULL,
+            card_three INTEGER NOT NULL,
+            PRIMARY KEY (run_id, game_id, game_iteration_id, player)
+        )
+        ''',
+        '''
+        CREATE INDEX IF NOT EXISTS idx_games_cell
+        ON games (num_players, knocker, knocker_score)
+        '''
+    ]
+
+    def __init__(self, path, read_only=False):
+        '''
+        read_only : bool
+            only query an existing store i.e., don't create the file or tables
+        '''
+        self.path = path
+        if read_only:
+            # raises sqlite3.OperationalError if the file doesn't exist
+            uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+            self.connection = sqlite3.connect(uri, uri=True)
+        else:
+            self.connection = sqlite3.connect(path)
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+            self.connection.commit()
+
+    def add_game(self, game, run_id, game_id, game_iteration_id, ts_created=None):
+        '''
+        add a played ThirtyOne game
+        '''
+
+        # hands are stored sorted (same as they're printed)
+        knocker_hand = encode_cards(sorted(game.hands[game.knocker].cards))
+        self.connection.execute(
+            "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                run_id,
+                game_id,
+                game_iteration_id,
+                ts_created,
+                len(game.players),
+                game.round,
+                game.turns,
+                game.knocker,
+                game.scores[game.knocker],
+                int(bool(game.knocker_survived)),
+                *knocker_hand,
+                bytes(encode_cards(game.deck.cards)),
+                bytes(encode_cards(game.discard.cards))
+            )
+        )
+        self.connection.executemany(
+            "INSERT INTO hands VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (run_id, game_id, game_iteration_id, player, hand.score, *encode_cards(sorted(hand.cards)))
+                for player, hand in enumerate(game.hands)
+            ]
+        )
+
+    def import_csv(self, path, run_id=None):
+        '''
+        add the games in a results CSV (e.g., output/*_results.csv)
+        rows are streamed so the CSV is never fully loaded into memory
+        run_id defaults to the CSV's file name
+        if any game is already in the store, nothing from the CSV is added
+        '''
+
+        if run_id is None:
+            run_id = os.path.basename(path)
+
+        # commit once at the end or roll back everything on error
+        with self.connection, open(path, newline='') as f:
+            for row in csv.DictReader(f):
+
+                knocker = int(row['knocker'])
+                hands = parse_cards(row['hands'])
+                scores = parse_scores(row['scores'])
+
+                self.connection.execute(
+                    "INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        run_id,
+                        int(row['game_id']),
+                        int(row['game_iteration_id']),
+                        float(row['ts_created']),
+                        int(row['num_players']),
+                        int(row['rounds_played']),
+                        int(row['turns_played']),
+                        knocker,
+                        float(row['knocker_score']),
+                        int(row['knocker_survived'] == "True"),
+                        *encode_cards(parse_cards(row['knocker_hand'])),
+                        bytes(encode_cards(parse_cards(row['deck']))),
+                        bytes(encode_cards(parse_cards(row['discard'])))
+                    )
+                )
+                self.connection.executemany(
+                    "INSERT INTO hands VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            run_id,
+                            int(row['game_id']),
+                            int(row['game_iteration_id']),
+                            player,
+                            scores[player],
+                            *encode_cards(hands[player * 3:player * 3 + 3])
+                        )
+                        for player in range(len(scores))
+                    ]
+                )
+
+    def aggregate(self, run_id=None, num_players=None, knocker=None, min_score=None, max_score=None, value=None, suit=None):
+        '''
+        knocker survival by num_players, knocker, and knocker_score
+        optionally filtered to games where the knocker's hand contains a card of the given value and/or suit
+        '''
+
+        # filter
+        where = []
+        params = []
+        if run_id is not None:
+            where.append("run_id = ?")
+            params.append(run_id)
+        if num_players is not None:
+            where.append("num_players = ?")
+            params.append(num_players)
+        if knocker is not None:
+            where.append("knocker = ?")
+            params.append(knocker)
+        if min_score is not None:
+            where.append("knocker_score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            where.append("knocker_score <= ?")
+            params.append(max_score)
+        columns = ["knocker_card_one", "knocker_card_two", "knocker_card_three"]
+        if value is not None:
+            where.append("(" + " OR ".join(f"{column} % 13 = ?" for column in columns) + ")")
+            params += [Card.VALUES.index(value)] * len(columns)
+        if suit is not None:
+            where.append("(" + " OR ".join(f"{column} / 13 = ?" for column in columns) + ")")
+            params += [Card.SUITS.index(suit)] * len(columns)
+
+        query = (
+            "SELECT num_players, knocker, knocker_score, "
+            "COUNT(*) AS game_id_count, SUM(knocker_survived) AS knocker_survived_sum "
+            "FROM games "
+            + ("WHERE " + " AND ".join(where) + " " if len(where) > 0 else "")
+            + "GROUP BY num_players, knocker, knocker_score "
+            "ORDER BY num_players, knocker, knocker_score"
+        )
+
+        table = []
+        for num_players, knocker, knocker_score, count, survived in self.connection.execute(query, params):
+            table.append({
+                'num_players': num_players,
+                'knocker': knocker,
+                'knocker_score': knocker_score,
+                'game_id_count': count,
+                'knocker_survived_sum': survived,
+                'win_percentage': survived / count
+            })
+        return table
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+if __name__ == "__main__":
+
+    # e.g., survival for 4 players, position 2, hands containing an ace
+    # python store.py "output/2021-01-01 0000_results.db" --num-players 4 --knocker 2 --value A
+
+    parser = argparse.ArgumentParser(description="aggregate knocker survival from a results store")
+    parser.add_argument("path", help="results store (e.g., output/*_results.db)")
+    parser.add_argument("--import-csv", help="add the games in a results CSV to the store first")
+    parser.add_argument("--run-id", help="run of the imported CSV (default: its file name) and/or run to aggregate")
+    parser.add_argument("--num-players", type=int)
+    parser.add_argument("--knocker", type=int)
+    parser.add_argument("--min-score", type=float)
+    parser.add_argument("--max-score", type=float)
+    parser.add_argument("--value", choices=Card.VALUES, help="knocker's hand contains a card of this value")
+    parser.add_argument("--suit", choices=Card.SUITS, help="knocker's hand contains a card of this suit")
+    args = parser.parse_args()
+
+    # only create a store when importing into it
+    # otherwise, a mistyped path would silently query a new, empty store
+    if args.import_csv is None and not os.path.exists(args.path):
+        parser.error(f"results store not found: {args.path}")
+
+    store = ResultsStore(args.path, read_only=args.import_csv is None)
+    if args.import_csv is not None:
+        store.import_csv(args.import_csv, run_id=args.run_id)
+
+    table = store.aggregate(
+        run_id=args.run_id,
+        num_players=args.num_players,
+        knocker=args.knocker,
+        min_score=args.min_score,
+        max_score=args.max_score,
+        value=args.value,
+        suit=args.suit
+    )
+    store.close()
+
+    for row in table:
+        row['win_percentage'] = f"{row['win_percentage']:.1%}"
+    print(tabulate(table, headers='keys', tablefmt='github'))